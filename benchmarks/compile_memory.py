@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measures the time & peak memory of compiling a large synthetic config into queries & actions
+
+Usage (from the repo root):
+    python3 benchmarks/compile_memory.py [--compact] [--labels 300]
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.filter_builder import GMailFilter
+
+
+def build_config(n_labels: int) -> dict:
+    """Builds labels with 300 addresses OR'd with 50 multi-word text terms each"""
+    random.seed(1)
+    actions = ['archive', 'never-important', 'mark-read', 'never-spam']
+    config = {}
+    for i in range(n_labels):
+        config[f'Label{i}'] = {
+            'actions': random.sample(actions, 2),
+            'data': [
+                {'or-from': [f'u{random.randint(0, 50000)}@d{random.randint(0, 3000)}.com' for _ in range(300)]},
+                {'join': 'or'},
+                {'or-text': [f'word {random.randint(0, 20000)}' for _ in range(50)]},
+            ]
+        }
+    return config
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--compact', action='store_true')
+parser.add_argument('--labels', type=int, default=300)
+args = parser.parse_args()
+
+config = build_config(args.labels)
+filter_tools = GMailFilter(compact=args.compact)
+filter_tools.log.setLevel(logging.WARNING)
+
+tracemalloc.start()
+start = time.perf_counter()
+n_filters = 0
+for fdict in config.values():
+    n_filters += len(filter_tools.query_organizer(fdict))
+    filter_tools.action_assembler(fdict, 'Label_1')
+elapsed = time.perf_counter() - start
+peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+
+print(f'{"compact" if args.compact else "verbose"}: {n_filters} filters, '
+      f'peak {peak // 1024} KiB, {elapsed:.2f}s')
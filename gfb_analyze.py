@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+For finding overlapping entries & conflicting actions across labels
+"""
+from utils.yaml_organizer import YamlWrapper
+from utils.filter_analyzer import FilterAnalyzer
+from utils.logger import Log
+
+
+log = Log('filter-analyzer')
+log.debug('Initializing script')
+# Read in the YAML file
+# Debug
+#   When True: points to the example yaml file in this repo.
+#   When False (default): takes in 1st argument in script run (i.e., sys.argv[1])
+gmail_filters = YamlWrapper(debug=False).gmail_filters
+FilterAnalyzer(gmail_filters).log_report()
+log.debug('Analysis complete. Ending script.')
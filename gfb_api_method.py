@@ -2,9 +2,14 @@
 # -*- coding: utf-8 -*-
 """
 For building an managing filters in gmail
+
+Optional flags (after the YAML path):
+    --backfill: applies the new filters to existing email
 """
-from utils.gmail import GMailLabelAPI, GMailFilterAPI
+import sys
+from utils.gmail import GMailLabelAPI, GMailFilterAPI, GMailMessageAPI
 from utils.filter_builder import GMailFilter
+from utils.snapshot import FilterSnapshot
 from utils.yaml_organizer import YamlWrapper
 from utils.logger import Log
 
@@ -16,11 +21,14 @@ log.debug('Logging initiated')
 #   When True: points to the example yaml file in this repo.
 #   When False (default): takes in 1st argument in script run (i.e., sys.argv[1])
 gmail_filters = YamlWrapper().gmail_filters
+backfill = '--backfill' in sys.argv[2:]
 # Load tools & API services
-filter_tools = GMailFilter()
+# Compact: emits the shortest equivalent query syntax to fit more criteria per filter
+filter_tools = GMailFilter(compact=True)
 log.debug('Initializing APIs')
 label_svc = GMailLabelAPI()
 filter_svc = GMailFilterAPI()
+message_svc = GMailMessageAPI() if backfill else None
 
 # Get already-existing labels
 all_labels = label_svc.get_all_labels(label_type='user')
@@ -29,6 +37,9 @@ label_id_list = [x['id'] for x in all_labels]
 # Get already-existing filters
 all_filters = filter_svc.list_filters()
 
+# Save the old filters so they can be restored (via gfb_restore.py) if the new ones misbehave
+FilterSnapshot(label_svc, filter_svc).save()
+
 # Remove all the old filters
 log.debug('Beginning filter removal process...')
 for i, f in enumerate(all_filters):
@@ -37,6 +48,8 @@ for i, f in enumerate(all_filters):
 
 # Create new filters
 log.debug('Beginning new label/filter creation process...')
+# Compiled (query, actions) pairs to apply to existing email
+backfill_jobs = []
 for label_name, data in gmail_filters.items():
     log.debug(f'Working on label {label_name}')
     # Determine if the label already exists
@@ -55,5 +68,10 @@ for label_name, data in gmail_filters.items():
     for i, query in enumerate(queries):
         log.debug(f'Applying query {i + 1} of {len(queries)}...')
         filter_svc.create_filter(query=query, actions_dict=actions)
+        backfill_jobs.append((query, actions))
+
+if backfill:
+    log.debug(f'Applying {len(backfill_jobs)} queries to existing email...')
+    message_svc.backfill(backfill_jobs)
 
 log.debug('Process completed. Ending script.')
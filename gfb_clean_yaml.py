@@ -2,16 +2,29 @@
 # -*- coding: utf-8 -*-
 """
 For cleaning & sorting entries in a YAML file
+
+Optional flags (after the YAML path):
+    --check: lists labels that aren't sorted without writing anything. Exits with 1 if there are any
+    --incremental: only sorts labels that changed since they were last cleaned
 """
+import sys
 from utils.yaml_organizer import YamlWrapper
 from utils.logger import Log
 
 
 log = Log('filter-cleaner')
 log.debug('Initializing script')
+flags = sys.argv[2:]
 # Read in the YAML file
 # Debug
 #   When True: points to the example yaml file in this repo.
 #   When False (default): takes in 1st argument in script run (i.e., sys.argv[1])
-YamlWrapper(debug=False).sort_and_save()
+yaml_wrapper = YamlWrapper(debug=False)
+if '--check' in flags:
+    unsorted = yaml_wrapper.check_sorted(incremental='--incremental' in flags)
+    for label in unsorted:
+        log.info(f'Unsorted: {label}')
+    log.debug(f'Found {len(unsorted)} unsorted labels. Ending script.')
+    sys.exit(1 if len(unsorted) > 0 else 0)
+yaml_wrapper.sort_and_save(incremental='--incremental' in flags)
 log.debug('Filter cleaning complete. Ending script.')
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+For replacing the live filters with those saved in a snapshot file
+    Takes the path to the snapshot (i.e., sys.argv[1])
+"""
+import sys
+from utils.snapshot import FilterSnapshot
+from utils.logger import Log
+
+
+log = Log('restore-script')
+log.debug('Logging initiated')
+FilterSnapshot().restore(sys.argv[1])
+log.debug('Restore completed. Ending script.')
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+For saving the live filters & labels to a snapshot file
+    Takes an optional path to save to (defaults to snapshots/filters-{timestamp}.json.gz)
+"""
+import sys
+from utils.snapshot import FilterSnapshot
+from utils.logger import Log
+
+
+log = Log('snapshot-script')
+log.debug('Logging initiated')
+path = sys.argv[1] if len(sys.argv) > 1 else None
+FilterSnapshot().save(path)
+log.debug('Snapshot saved. Ending script.')
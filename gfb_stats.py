@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+For estimating how much existing mail each label's filters will catch
+"""
+from utils.yaml_organizer import YamlWrapper
+from utils.query_stats import QueryStats
+from utils.logger import Log
+
+
+log = Log('stats-script')
+log.debug('Logging initiated')
+# Read in the YAML file
+# Debug
+#   When True: points to the example yaml file in this repo.
+#   When False (default): takes in 1st argument in script run (i.e., sys.argv[1])
+gmail_filters = YamlWrapper(debug=False).gmail_filters
+QueryStats(gmail_filters).log_report()
+log.debug('Stats complete. Ending script.')
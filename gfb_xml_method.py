@@ -3,7 +3,6 @@
 """
 For building an managing filters in gmail
 """
-from utils.filter_builder import GMailFilter
 from utils.yaml_organizer import YamlWrapper
 from utils.xml_builder import XMLBuilder
 from utils.logger import Log
@@ -17,8 +16,8 @@ log = Log('main-script')
 log.debug('Logging initiated')
 gmail_filters = YamlWrapper(debug=False).gmail_filters
 # Load tools & API services
-filter_tools = GMailFilter()
-xml_tools = XMLBuilder(gmail_filters)
+# Compact: emits the shortest equivalent query syntax to fit more criteria per filter
+xml_tools = XMLBuilder(gmail_filters, compact=True)
 # Generate the xml & save to path
 # (defaults to ~/Documents/gmail_filters.xml)
 xml_tools.generate_xml()
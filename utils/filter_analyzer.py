@@ -0,0 +1,179 @@
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+from .logger import Log
+
+
+class FilterAnalyzer:
+    """Finds overlapping criteria, conflicting actions and shadowed entries across labels
+
+    Builds inverted indexes of every normalized address, domain and text term
+        to the labels that reference it, so each check is a dictionary lookup
+        rather than a comparison against every other entry.
+    Only criteria that catch mail on their own are indexed. Criteria ANDed with others
+        (e.g., a sender AND a subject) are left out, as they don't overlap with other labels by themselves.
+    """
+    EMAIL_KEYS = ('from', 'to', 'cc', 'bcc', 'replyto', 'list')
+    # Pairs of actions that shouldn't be applied to the same email
+    CONFLICTS = {
+        frozenset(['always-important', 'never-important']): 'marked both important and never important',
+        frozenset(['delete-email', 'always-important']): 'deleted while marked important',
+        frozenset(['delete-email', 'mark-starred']): 'deleted while starred',
+        frozenset(['delete-email', 'never-spam']): 'deleted while protected from spam',
+    }
+
+    def __init__(self, gmail_filter_dict: dict):
+        self.log = Log('filter-analyzer')
+        self.gmail_filters = gmail_filter_dict
+        # label name -> set of actions
+        self.label_actions = {}
+        # (key, entry) -> labels referencing it
+        self.address_index = defaultdict(set)
+        self.domain_index = defaultdict(set)
+        self.term_index = defaultdict(set)
+        self._build_indexes()
+
+    @staticmethod
+    def normalize_email(entry: str) -> Tuple[str, str]:
+        """Normalizes an email entry and determines whether it targets an address or a whole domain
+        (e.g., '*@Site.com' -> ('domain', 'site.com'), '*.site.com' -> ('domain', 'site.com'))
+        """
+        entry = entry.strip().lower()
+        if '@' in entry:
+            local, domain = entry.rsplit('@', 1)
+            if local.strip('*') == '':
+                return 'domain', domain.lstrip('*.')
+            return 'address', entry
+        return 'domain', entry.strip('*.')
+
+    @staticmethod
+    def _parent_domains(domain: str) -> List[str]:
+        """Lists the parent domains of a domain (e.g., 'a.b.com' -> ['b.com'])"""
+        parts = domain.split('.')
+        return ['.'.join(parts[i:]) for i in range(1, len(parts) - 1)]
+
+    @staticmethod
+    def _is_and_group(data: List[dict]) -> bool:
+        """Checks whether the criteria in a data list are ANDed together at this level.
+        Since OR binds tighter than AND in GMail, a single AND (or two criteria with no joiner between them)
+            means no criteria in the list can catch mail on its own
+        """
+        prev_is_criteria = False
+        for item in data:
+            for k, v in item.items():
+                if k == 'join':
+                    if str(v).lower() == 'and':
+                        return True
+                    prev_is_criteria = False
+                    continue
+                if 'section' in k and '-' in k:
+                    # Sections carry their leading joiner (e.g., or-section)
+                    if k.split('-')[0].lower() == 'and':
+                        return True
+                    prev_is_criteria = False
+                if prev_is_criteria:
+                    # Nothing joining this criteria to the previous one
+                    return True
+                prev_is_criteria = True
+        return False
+
+    def _index_data(self, label: str, data: List[dict]):
+        """Walks the data section of a label and adds each positive criteria
+        that can catch mail on its own (i.e., isn't ANDed with other criteria) to the indexes
+        """
+        if self._is_and_group(data):
+            return
+        for item in data:
+            for k, v in item.items():
+                if k == 'join':
+                    continue
+                if isinstance(v, list) and len(v) > 0 and isinstance(v[0], dict):
+                    # Nested section
+                    self._index_data(label, v)
+                    continue
+                # Item follows the {join}-{key}[-not] syntax
+                key_split = k.split('-')
+                if len(key_split) != 2:
+                    # Negated criteria exclude mail instead of catching it
+                    continue
+                join, key = key_split
+                values = [v] if isinstance(v, str) else v
+                if join == 'and' and len(values) > 1:
+                    # Each value only catches mail alongside the others
+                    continue
+                for entry in values:
+                    if key in self.EMAIL_KEYS:
+                        kind, normalized = self.normalize_email(entry)
+                        index = self.address_index if kind == 'address' else self.domain_index
+                        index[(key, normalized)].add(label)
+                    else:
+                        self.term_index[(key, entry.strip().lower())].add(label)
+
+    def _build_indexes(self):
+        """Populates the inverted indexes from every label"""
+        for label, fdict in self.gmail_filters.items():
+            self.label_actions[label] = frozenset(fdict.get('actions', []))
+            self._index_data(label, fdict.get('data', []))
+        self.log.debug(f'Indexed {len(self.address_index)} addresses, {len(self.domain_index)} domains '
+                       f'and {len(self.term_index)} terms across {len(self.label_actions)} labels')
+
+    def _conflicts(self, labels: Set[str]) -> List[str]:
+        """Lists the conflicting actions between the provided labels"""
+        actions = set()
+        for label in labels:
+            actions.update(self.label_actions[label])
+        return [reason for pair, reason in self.CONFLICTS.items() if pair <= actions]
+
+    def find_overlaps(self) -> List[Dict[str, object]]:
+        """Lists entries referenced by more than one label, along with any conflicting actions"""
+        overlaps = []
+        for index in (self.address_index, self.domain_index, self.term_index):
+            for (key, entry), labels in index.items():
+                if len(labels) > 1:
+                    overlaps.append({
+                        'key': key,
+                        'entry': entry,
+                        'labels': sorted(labels),
+                        'conflicts': self._conflicts(labels)
+                    })
+        return overlaps
+
+    def _shadowing_labels(self, key: str, domain: str) -> Set[str]:
+        """Returns the labels with a domain entry covering the subdomains of the provided domain"""
+        labels = set()
+        for parent in self._parent_domains(domain):
+            labels.update(self.domain_index.get((key, parent), set()))
+        return labels
+
+    def find_shadowed(self) -> List[Dict[str, object]]:
+        """Lists addresses & subdomains already caught by a broader domain entry"""
+        shadowed = []
+        for (key, address), labels in self.address_index.items():
+            domain = address.rsplit('@', 1)[1]
+            covering = self._shadowing_labels(key, domain)
+            covering.update(self.domain_index.get((key, domain), set()))
+            if len(covering) > 0:
+                shadowed.append({'key': key, 'entry': address, 'labels': sorted(labels),
+                                 'shadowed_by': sorted(covering), 'conflicts': self._conflicts(labels | covering)})
+        for (key, domain), labels in self.domain_index.items():
+            covering = self._shadowing_labels(key, domain)
+            if len(covering) > 0:
+                shadowed.append({'key': key, 'entry': domain, 'labels': sorted(labels),
+                                 'shadowed_by': sorted(covering), 'conflicts': self._conflicts(labels | covering)})
+        return shadowed
+
+    def log_report(self):
+        """Logs the overlaps, conflicts and shadowed entries"""
+        overlaps = self.find_overlaps()
+        shadowed = self.find_shadowed()
+        conflicts = [x for x in overlaps + shadowed if len(x['conflicts']) > 0]
+        self.log.debug(f'Found {len(overlaps)} overlaps, {len(shadowed)} shadowed entries '
+                       f'and {len(conflicts)} conflicting actions.')
+        for overlap in overlaps:
+            self.log.info(f'Overlap: {overlap["key"]}:{overlap["entry"]} is in {", ".join(overlap["labels"])}')
+        for conflict in conflicts:
+            labels = sorted(set(conflict['labels'] + conflict.get('shadowed_by', [])))
+            self.log.warning(f'Conflict: {conflict["key"]}:{conflict["entry"]} is '
+                             f'{"; ".join(conflict["conflicts"])} ({", ".join(labels)})')
+        for shadow in shadowed:
+            self.log.info(f'Shadowed: {shadow["key"]}:{shadow["entry"]} in {", ".join(shadow["labels"])} '
+                          f'is already covered by {", ".join(shadow["shadowed_by"])}')
@@ -1,10 +1,13 @@
+import re
 from math import ceil
-from typing import Dict, Union, List, Tuple, Optional
+from typing import Dict, Union, List, Tuple, Optional, Iterator
 from .logger import Log
 
 
 class Action:
     """GMail Actions"""
+    __slots__ = ('as_xml', 'add_actions', 'remove_actions', 'xml_actions')
+
     def __init__(self, action_list: List[str], as_xml: bool = False):
         self.as_xml = as_xml
         # When using Gmail API (as_xml = False)
@@ -12,16 +15,6 @@ class Action:
         self.remove_actions = []
         # When building an XML (as_xml = True)
         self.xml_actions = []
-
-        self.action_map = {
-            'archive': self.action_archive,
-            'mark-read': self.action_mark_read,
-            'never-spam': self.action_never_spam,
-            'never-important': self.action_never_important,
-            'always-important': self.action_always_important,
-            'delete-email': self.action_delete_email,
-            'mark-starred': self.action_mark_starred
-        }
         # Build out the action lists
         self._process_actions(action_list)
 
@@ -29,7 +22,7 @@ class Action:
         """Move through the list of actions and build out the final action lists"""
         for action in action_list:
             # Call the action, which will add to the respective lists
-            self.action_map[action]()
+            self.ACTION_MAP[action](self)
 
     def build_actions(self, label_id: str = None) -> Union[Dict[str, List[str]], List[str]]:
         """Takes the action lists and compiles them into a dictionary to create a filter
@@ -103,12 +96,140 @@ class Action:
         else:
             self.add_actions.append('STARRED')
 
+    # Mapping of YAML action names to their methods, built once for all instances
+    ACTION_MAP = {
+        'archive': action_archive,
+        'mark-read': action_mark_read,
+        'never-spam': action_never_spam,
+        'never-important': action_never_important,
+        'always-important': action_always_important,
+        'delete-email': action_delete_email,
+        'mark-starred': action_mark_starred
+    }
+
+
+class QueryParser:
+    """Parses a built GMail query back into a canonical, order-independent form
+    so two differently-written queries can be checked for equivalence.
+
+    Follows GMail's precedence, where OR (`|`, `OR`, `{}`) binds tighter than AND (` `, `AND`)
+    """
+    KEYS = ('from', 'cc', 'bcc', 'to', 'list', 'replyto', 'subject')
+    # Matches a quoted term, a bracket/pipe, a bare word or an unmatched quote
+    TOKEN_RE = re.compile(r'"([^"]*)"|([()|{}])|([^\s()|{}"]+)|(")')
+
+    def __init__(self, query: str):
+        self.tokens = list(self._tokenize(query.replace('&quot;', '"')))
+        self.pos = 0
+
+    def _tokenize(self, query: str) -> Iterator[Tuple[str, Optional[str]]]:
+        """Splits the query into (type, value) tokens"""
+        for match in self.TOKEN_RE.finditer(query):
+            quoted, bracket, word, unmatched = match.groups()
+            if unmatched:
+                raise ValueError('Unmatched quote in query')
+            elif bracket:
+                yield bracket, None
+            elif word:
+                yield from self._word_tokens(word)
+            else:
+                yield 'TERM', quoted
+
+    def _word_tokens(self, word: str) -> List[Tuple[str, Optional[str]]]:
+        """Breaks a bare word into negation, key and term tokens"""
+        if word in ('OR', 'AND'):
+            return [(word, None)]
+        tokens = []
+        while word.startswith('-'):
+            tokens.append(('NOT', None))
+            word = word[1:]
+        key, sep, value = word.partition(':')
+        if sep and key in self.KEYS:
+            tokens.append(('KEY', key))
+            word = value
+        if word != '':
+            tokens.append(('TERM', word))
+        return tokens
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def _next(self) -> Tuple[str, Optional[str]]:
+        if self.pos >= len(self.tokens):
+            raise ValueError('Unexpected end of query')
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    @staticmethod
+    def _op(kind: str, nodes: List[tuple]) -> tuple:
+        """Builds an and/or node, flattening nested nodes of the same kind"""
+        flat = set()
+        for node in nodes:
+            if node[0] == kind:
+                flat.update(node[1])
+            else:
+                flat.add(node)
+        if len(flat) == 1:
+            return flat.pop()
+        return kind, frozenset(flat)
+
+    def parse(self) -> tuple:
+        """Parses the full query"""
+        node = self._and_expr(None)
+        if self._peek() is not None:
+            raise ValueError(f'Unexpected token at position {self.pos}: {self.tokens[self.pos]}')
+        return node
+
+    def _and_expr(self, key: Optional[str]) -> tuple:
+        nodes = [self._or_expr(key)]
+        while self._peek() not in (None, ')', '}'):
+            if self._peek() == 'AND':
+                self._next()
+            nodes.append(self._or_expr(key))
+        return self._op('and', nodes)
+
+    def _or_expr(self, key: Optional[str]) -> tuple:
+        nodes = [self._unary(key)]
+        while self._peek() in ('OR', '|'):
+            self._next()
+            nodes.append(self._unary(key))
+        return self._op('or', nodes)
+
+    def _unary(self, key: Optional[str]) -> tuple:
+        if self._peek() == 'NOT':
+            self._next()
+            return 'not', self._unary(key)
+        return self._primary(key)
+
+    def _primary(self, key: Optional[str]) -> tuple:
+        kind, value = self._next()
+        if kind == 'KEY':
+            return self._primary(value)
+        elif kind == '(':
+            node = self._and_expr(key)
+            self._next()
+            return node
+        elif kind == '{':
+            nodes = []
+            while self._peek() != '}':
+                nodes.append(self._unary(key))
+            self._next()
+            return self._op('or', nodes)
+        elif kind == 'TERM':
+            return 'term', key, value.lower()
+        raise ValueError(f'Unexpected token: {kind}')
+
 
 class GMailFilter:
     """Class for building a single GMail filter"""
+    # Characters that require a text term to be wrapped in quotes
+    NEEDS_QUOTES = re.compile(r'[\s()|{}":]|^-|^(OR|AND)$')
 
-    def __init__(self, as_xml: bool = False):
+    def __init__(self, as_xml: bool = False, compact: bool = False):
         self.as_xml = as_xml
+        # When compact, each criteria is emitted in its shortest equivalent form
+        self.compact = compact
         # Maximum (supposed) limit of characters to use in a query
         self.char_limit = 600
         # Using the API method, we don't need to format quotes
@@ -119,10 +240,15 @@ class GMailFilter:
             'and': ' ',
             'not': '-'
         }
+        # Joiners placed between criteria & sections
+        self.or_sep = '|' if self.compact else ' OR '
+        self.and_sep = ' ' if self.compact else ' AND '
+        # Compact queries are checked against (and fall back to) the verbose form
+        self.verbose_filter = GMailFilter(as_xml=self.as_xml) if self.compact else None
         self.log = Log('filter-builder')
 
     def criteria_constructor(self, values: Union[List[str], str], key_part: Optional[str] = None,
-                             join_part: Optional[str] = None, not_part: Optional[str] = None) -> List[str]:
+                             join_part: Optional[str] = None, not_part: Optional[str] = None) -> Iterator[str]:
         """Handles the construction of specific criteria of the filter
         (e.g., from: to: subject, etc...)
 
@@ -130,30 +256,94 @@ class GMailFilter:
             the string will be split accordingly
         """
         if key_part is None:
-            chunk = f' {values.upper()} '
-        elif key_part in ('from', 'cc', 'bcc', 'to', 'list', 'replyto', 'subject'):
-            chunk = f'{key_part}:({join_part.join(values)})'
+            chunk = self._joiner(values)
+        elif self.compact:
+            chunk = self._compact_chunk(values, key_part, join_part)
         else:
-            # Handles text area
-            chunk = '({})'.format(join_part.join(['{0}{1}{0}'.format(self.q, x) for x in values]))
+            chunk = self._verbose_chunk(values, key_part, join_part)
         if not_part is not None:
             chunk = f'-{chunk}'
 
         if self._is_oversized(chunk):
             n_times = ceil(len(chunk) / self.char_limit)
             chunk_size = ceil(len(values) / n_times)
-            chunks = []
             for i in range(n_times):
                 st_pos = i * chunk_size
                 end_pos = st_pos + chunk_size
-                chunks += self.criteria_constructor(values[st_pos:end_pos], key_part, join_part, not_part)
-            return chunks
-        return [chunk]
+                yield from self.criteria_constructor(values[st_pos:end_pos], key_part, join_part, not_part)
+        else:
+            yield chunk
+
+    def _joiner(self, join: str) -> str:
+        """Returns the string used to join criteria or sections"""
+        if join.lower() == 'or':
+            return self.or_sep
+        elif join.lower() == 'and':
+            return self.and_sep
+        return f' {join.upper()} '
+
+    def _quote(self, term: str) -> str:
+        """Wraps a text term in quotes, unless it's a single token that can stand alone"""
+        if self.compact and self.NEEDS_QUOTES.search(term) is None:
+            return term
+        return '{0}{1}{0}'.format(self.q, term)
+
+    def _verbose_chunk(self, values: List[str], key_part: str, join_part: str) -> str:
+        """Builds a single criteria with every term bracketed (and quoted, for text)"""
+        if key_part in QueryParser.KEYS:
+            return f'{key_part}:({join_part.join(values)})'
+        # Handles text area
+        return '({})'.format(join_part.join(['{0}{1}{0}'.format(self.q, x) for x in values]))
+
+    def _compact_chunk(self, values: List[str], key_part: str, join_part: str) -> str:
+        """Picks the shortest equivalent syntax for a single criteria"""
+        if key_part in QueryParser.KEYS:
+            if len(values) == 1 and self.NEEDS_QUOTES.search(values[0]) is None:
+                # A single term that can stand alone doesn't need brackets
+                return f'{key_part}:{values[0]}'
+            return f'{key_part}:({join_part.join(values)})'
+        terms = [self._quote(x) for x in values]
+        if len(terms) == 1:
+            return terms[0]
+        return f'({join_part.join(terms)})'
+
+    def _merge_same_keys(self, data: List[dict]) -> List[dict]:
+        """Merges neighboring OR criteria that share a key
+        (e.g., `or-from: [a]`, `join: or`, `or-from: [b]` -> `or-from: [a, b]`)
+
+        Only OR is merged, as it binds tighter than AND in GMail. Criteria with a value needing quotes
+            (e.g., `subject: hello world`) are kept separate, since keyed values are never quoted
+            and `subject:(hello world|foo)` would read as `hello AND (world OR foo)`
+        """
+        merged = []
+        for item in data:
+            if len(item) != 1:
+                merged.append(item)
+                continue
+            (k, v), = item.items()
+            if 'section' in k and isinstance(v, list):
+                item = {k: self._merge_same_keys(v)}
+            elif (k.startswith('or-') and not k.endswith('-not') and len(merged) >= 2
+                  and str(merged[-1].get('join', '')).lower() == 'or' and list(merged[-2].keys()) == [k]):
+                # Same key on both sides of an OR join; combine values, dropping duplicates
+                prev = merged[-2][k]
+                prev = [prev] if isinstance(prev, str) else prev
+                v = [v] if isinstance(v, str) else v
+                if any(self.NEEDS_QUOTES.search(x) is not None for x in prev + v):
+                    merged.append(item)
+                    continue
+                merged[-2] = {k: prev + [x for x in v if x not in prev]}
+                # Drop the joiner
+                merged.pop()
+                continue
+            merged.append(item)
+        return merged
 
     def _is_oversized(self, string: Union[str, List[str]]) -> bool:
         """Checks if provided string is larger than the character limit"""
         if isinstance(string, list):
-            string = ''.join(string)
+            # Sum the lengths rather than joining into a throwaway string
+            return sum(map(len, string)) >= self.char_limit
         if len(string) >= self.char_limit:
             return True
         return False
@@ -176,7 +366,7 @@ class GMailFilter:
 
         return join_part, key_part, not_part
 
-    def query_constructor(self, section: Union[List[str], dict]) -> List[str]:
+    def query_constructor(self, section: Union[List[str], dict]) -> Iterator[str]:
         """Builds the query (i.e., assembles multiple criteria into a single query string)
         Args:
             section: list of str or dict, contains things like list of emails, text
@@ -184,9 +374,9 @@ class GMailFilter:
         """
         if isinstance(section, str):
             # Section is likely a joiner if it's just string (e.g., 'and', 'or')
-            return [section]
+            yield section
+            return
         # Begin constructing the section from a dictionary
-        sections = []
         for k, v in section.items():
             # Item follows the {join}-{key}[-not] syntax
             join_part, key_part, not_part = self._key_splitter(k)
@@ -201,23 +391,30 @@ class GMailFilter:
                     # Dealing with a section; parse out the leading joiner (if any)
                     #   and throw it in before it if there are other items in front
                     joiner = k.split('-')[0]
-                    sections.append(f' {joiner.upper()} ')
-                sections.append('(')
-                for sect in v:
-                    # Process the section
-                    sections += self.query_constructor(sect)
-                sections.append(')')
-                return sections
-            sections += self.criteria_constructor(v, key_part, join_part, not_part)
-        return sections
-
-    @staticmethod
-    def _combine_and(filters: List[str]) -> List[str]:
+                    yield self._joiner(joiner)
+                # Process the section
+                subsections = (chunk for sect in v for chunk in self.query_constructor(sect))
+                first = next(subsections)
+                second = next(subsections, None)
+                if self.compact and second is None:
+                    # A section with a single criteria doesn't need brackets
+                    yield first
+                else:
+                    yield '('
+                    yield first
+                    if second is not None:
+                        yield second
+                        yield from subsections
+                    yield ')'
+                return
+            yield from self.criteria_constructor(v, key_part, join_part, not_part)
+
+    def _combine_and(self, filters: List[str]) -> List[str]:
         """ Go through the filters, combine AND filters"""
         rebuilt_filters = []
         cnt = 0
         for i, filt in enumerate(filters):
-            if filt == ' AND ':
+            if filt == self.and_sep:
                 # Combine the previous entry with this one and the next, reset i
                 rebuilt_filters[-1] = ''.join(filters[i - 1:i + 2])
                 cnt = i + 2
@@ -255,7 +452,7 @@ class GMailFilter:
                                      'It currently cannot be saved as a single filter. Reduce it at once.')
                 rebuilt_filters.append(section)
                 cnt = i + j
-            elif filt == ' OR ':
+            elif filt == self.or_sep:
                 if fstr == '':
                     # Skip on new string construction
                     pass
@@ -300,6 +497,29 @@ class GMailFilter:
         spaced[0::2] = use_list
         return ['('] + spaced + [')'] if is_section else spaced
 
+    def _build_filters(self, fdict: Dict[str, Union[str, int]]) -> List[str]:
+        """Builds the list of criteria, joiners and section brackets for the label"""
+        data = self._merge_same_keys(fdict['data']) if self.compact else fdict['data']
+        filters = []
+        for filter_dict in data:
+            # Pass in a single dictionary of filter data (e.g., or-from: [])
+            start = len(filters)
+            filters.extend(self.query_constructor(filter_dict))
+            #   Check if combining them yields an oversized string
+            if self._is_oversized(filters[start:]):
+                # These filters are too big to be combined.
+                #   Keep them on their own and intersperse with ' OR '
+                filters[start:] = self._intersperse(filters[start:], self.or_sep)
+        return filters
+
+    @staticmethod
+    def is_equivalent(query: str, other_query: str) -> bool:
+        """Checks whether two queries match the same emails"""
+        try:
+            return QueryParser(query).parse() == QueryParser(other_query).parse()
+        except ValueError:
+            return False
+
     def query_organizer(self, fdict: Dict[str, Union[str, int]]) -> List[str]:
         """Handles the processing of the final query, mainly by
         splitting it into multiple parts in the event that the query exceeds 600 chars
@@ -308,25 +528,22 @@ class GMailFilter:
             fdict: dict, the label-specific dictionary resulting from the pre-processed YAML file
                 NOTE: expects a 'data' key
         """
-        filters = []
-        for filter_dict in fdict['data']:
-            # Pass in a single dictionary of filter data (e.g., or-from: [])
-            query = self.query_constructor(filter_dict)
-            #   Check if combining them yields an oversized string
-            if self._is_oversized(query):
-                # These filters are too big to be combined.
-                #   Keep them on their own and intersperse with ' OR '
-                query = self._intersperse(query, ' OR ')
-            filters += query
-        filter_text = ''.join(filters)
-        if self._is_oversized(filter_text):
+        filters = self._build_filters(fdict)
+        if self.compact:
+            # Confirm the rewrites (merged keys, dropped quotes & brackets, short joiners)
+            #   left the query meaning the same thing as the verbose form
+            verbose_filters = self.verbose_filter._build_filters(fdict)
+            if not self.is_equivalent(''.join(filters), ''.join(verbose_filters)):
+                self.log.warning('Compact query did not match the verbose query. Falling back to verbose.')
+                return self.verbose_filter.query_organizer(fdict)
+        if self._is_oversized(filters):
             # Cut the filter text down some by splitting some sections into separate filters
-            self.log.debug(f'Filter exceeded bounds: {len(filter_text)} > {self.char_limit}. Splitting.')
+            self.log.debug(f'Filter exceeded bounds: {sum(map(len, filters))} > {self.char_limit}. Splitting.')
             # Before splitting, combine any 'AND' queries
             filters = self._combine_and(filters)
             return self._merge_filters(filters)
         else:
-            return [filter_text]
+            return [''.join(filters)]
 
     def action_assembler(self, fdict: Dict[str, Union[str, List[str]]],
                          label_id: str = None) -> Union[Dict[str, List[str]], List[str]]:
@@ -1,12 +1,52 @@
 import os
+import time
+import random
 import pickle
-from typing import List, Optional, Dict, Union, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import List, Optional, Dict, Union, Any, Tuple, Iterator, Callable
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from .logger import Log
 
 
+class QuotaBudget:
+    """Thread-safe rate limiter that spaces out calls to stay under the per-user quota
+
+    Docs:
+        https://developers.google.com/gmail/api/reference/quota
+    """
+    def __init__(self, units_per_sec: int = 250):
+        self.units_per_sec = units_per_sec
+        self.next_free = time.monotonic()
+        self.lock = threading.Lock()
+
+    def spend(self, units: int):
+        """Blocks until the provided quota units can be used"""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_free)
+            self.next_free = start + units / self.units_per_sec
+        if start > now:
+            time.sleep(start - now)
+
+
+class BatchError(Exception):
+    """Raised after a batched call finishes when some of its requests failed
+
+    Attributes:
+        responses: the responses in the order the requests were given (None for failed requests)
+        errors: index of each failed request -> its exception
+    """
+    def __init__(self, responses: List[Any], errors: Dict[int, Exception]):
+        self.responses = responses
+        self.errors = errors
+        first = errors[min(errors.keys())]
+        super().__init__(f'{len(errors)} of {len(responses)} requests failed (first: {first})')
+
+
 class GMailAPI:
     """Methods for establishing and building a store of credentials for
     connecting to the GMail API"""
@@ -16,13 +56,21 @@ class GMailAPI:
     ]
     DEFAULT_GMAIL_CREDS = os.path.join('creds', 'gmail-credentials.json')
     DEFAULT_PICKLE_PATH = os.path.join('creds', 'token.pickle')
+    # Most requests recommended in a single batch call
+    BATCH_LIMIT = 50
+    # Times to retry a request that was rate limited (429) or hit a server error (5xx), with backoff
+    NUM_RETRIES = 5
 
     def __init__(self, google_creds_path: str = DEFAULT_GMAIL_CREDS,
                  pickle_path: str = DEFAULT_PICKLE_PATH):
         self.log = Log('gmail-api')
         self.credentials_path = google_creds_path
         self.pickle_path = pickle_path
+        self.credentials = None
         self.service = None
+        # Holds a service per worker thread
+        self._local = threading.local()
+        self.quota = QuotaBudget()
         self.start_service()
 
     def _look_for_pickles(self) -> Optional[Any]:
@@ -64,7 +112,86 @@ class GMailAPI:
     def start_service(self):
         """Initiates the GMailAPI service"""
         self.log.debug('Initiating GMail service...')
-        self.service = build('gmail', 'v1', credentials=self.get_credentials())
+        self.credentials = self.get_credentials()
+        self.service = build('gmail', 'v1', credentials=self.credentials)
+
+    def thread_service(self):
+        """Returns a service for the current thread.
+        The underlying http client isn't thread safe, so each worker thread builds its own
+        """
+        if getattr(self._local, 'service', None) is None:
+            self._local.service = build('gmail', 'v1', credentials=self.credentials, cache_discovery=False)
+        return self._local.service
+
+    @staticmethod
+    def _is_retryable(exception: Exception) -> bool:
+        """Checks whether a failed request was rate limited or hit a server error"""
+        return isinstance(exception, HttpError) and (exception.resp.status == 429 or exception.resp.status >= 500)
+
+    def _execute_batch(self, build_requests: List[Callable[[Any], Any]],
+                       units: int) -> Tuple[List[Any], Dict[int, Exception]]:
+        """Sends up to BATCH_LIMIT requests in a single http call on the current thread's service.
+        Requests that were rate limited or hit a server error are resent with backoff
+
+        Args:
+            build_requests: functions that take a service and return the request to execute
+            units: the quota cost of each request
+        Returns:
+            the responses in order (None for failed requests) and the index -> exception of failed requests
+        """
+        service = self.thread_service()
+        responses = [None] * len(build_requests)
+        errors = {}
+        pending = list(range(len(build_requests)))
+        for attempt in range(self.NUM_RETRIES + 1):
+            retry = []
+
+            def callback(request_id: str, response: Any, exception: Exception):
+                i = int(request_id)
+                if exception is None:
+                    responses[i] = response
+                    errors.pop(i, None)
+                else:
+                    errors[i] = exception
+                    if self._is_retryable(exception):
+                        retry.append(i)
+
+            batch = service.new_batch_http_request(callback=callback)
+            for i in pending:
+                batch.add(build_requests[i](service), request_id=str(i))
+            self.quota.spend(units * len(pending))
+            batch.execute()
+            if len(retry) == 0 or attempt == self.NUM_RETRIES:
+                break
+            pending = sorted(retry)
+            time.sleep(2 ** attempt + random.random())
+        return responses, errors
+
+    def execute_batched(self, build_requests: List[Callable[[Any], Any]], units: int,
+                        max_workers: int = 4) -> List[Any]:
+        """Splits the requests into batches and sends them concurrently, returning responses in order
+
+        Every batch is sent even if others fail. Once all are done,
+            raises a BatchError holding the responses & every failed request, if there were any
+        """
+        starts = range(0, len(build_requests), self.BATCH_LIMIT)
+        responses = []
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(self._execute_batch, build_requests[i:i + self.BATCH_LIMIT], units)
+                       for i in starts]
+            for start, future in zip(starts, futures):
+                n_requests = len(build_requests[start:start + self.BATCH_LIMIT])
+                try:
+                    chunk_responses, chunk_errors = future.result()
+                except Exception as e:
+                    # The whole batch call failed
+                    chunk_responses, chunk_errors = [None] * n_requests, {i: e for i in range(n_requests)}
+                responses += chunk_responses
+                errors.update({start + i: e for i, e in chunk_errors.items()})
+        if len(errors) > 0:
+            raise BatchError(responses, errors)
+        return responses
 
 
 class GMailLabelAPI(GMailAPI):
@@ -101,20 +228,32 @@ class GMailLabelAPI(GMailAPI):
         resp = self.label_actions.delete(userId='me', id=label['id']).execute()
         return resp
 
-    def create_label(self, label_name: str) -> Dict[str, Union[str, int]]:
-        """Creates a new label"""
-        new_label = {
+    @staticmethod
+    def _label_body(label_name: str) -> Dict[str, str]:
+        """Builds the body for a new label"""
+        return {
             'type': 'user',
             'name': label_name,
             'labelListVisibility': 'labelShowIfUnread',
             'messageListVisibility': 'show'
         }
 
-        resp = self.label_actions.create(userId='me', body=new_label).execute()
+    def create_label(self, label_name: str) -> Dict[str, Union[str, int]]:
+        """Creates a new label"""
+        resp = self.label_actions.create(userId='me', body=self._label_body(label_name)).execute()
         if 'id' in resp.keys():
             self.log.debug(f'Successfully created label with id {resp["id"]}')
         return resp
 
+    def create_labels(self, label_names: List[str]) -> List[Dict[str, Union[str, int]]]:
+        """Creates multiple labels with batched calls"""
+        resp = self.execute_batched([
+            lambda svc, name=name: svc.users().labels().create(userId='me', body=self._label_body(name))
+            for name in label_names
+        ], units=5)
+        self.log.debug(f'Successfully created {len(resp)} labels')
+        return resp
+
 
 class GMailFilterAPI(GMailAPI):
     """Filter methods
@@ -157,3 +296,153 @@ class GMailFilterAPI(GMailAPI):
     def delete_filter(self, filter_id: str = None):
         """Deletes a filter"""
         self.filter_actions.delete(userId='me', id=filter_id).execute()
+
+    def create_filters(self, filter_bodies: List[dict]) -> List[Dict[str, Union[str, int]]]:
+        """Builds multiple filters (each a dict of 'criteria' & 'action') with batched calls"""
+        return self.execute_batched([
+            lambda svc, body=body: svc.users().settings().filters().create(userId='me', body=body)
+            for body in filter_bodies
+        ], units=5)
+
+    def delete_filters(self, filter_ids: List[str]):
+        """Deletes multiple filters with batched calls"""
+        self.execute_batched([
+            lambda svc, filter_id=filter_id: svc.users().settings().filters().delete(userId='me', id=filter_id)
+            for filter_id in filter_ids
+        ], units=5)
+
+
+class GMailMessageReader(GMailAPI):
+    """Read-only message methods
+
+    Docs:
+        http://googleapis.github.io/google-api-python-client/docs/dyn/gmail_v1.users.messages.html
+        https://developers.google.com/gmail/api/reference/rest/v1/users.messages/list
+    """
+    # Reading messages needs a scope the other services don't have,
+    #   so it's only requested (and its token stored separately) when messages are used
+    SCOPES = [
+        'https://www.googleapis.com/auth/gmail.readonly'  # Read existing messages
+    ]
+    DEFAULT_PICKLE_PATH = os.path.join('creds', 'token-readonly.pickle')
+    # Quota units per call
+    LIST_COST = 5
+    PROFILE_COST = 1
+    # Most ids messages.list will return in a page
+    PAGE_SIZE = 500
+
+    def __init__(self, max_workers: int = 8, units_per_sec: int = 250):
+        super().__init__(pickle_path=self.DEFAULT_PICKLE_PATH)
+        self.max_workers = max_workers
+        self.quota = QuotaBudget(units_per_sec)
+
+    def get_email_address(self) -> str:
+        """Pulls the email address of the authenticated account"""
+        self.quota.spend(self.PROFILE_COST)
+        resp = self.thread_service().users().getProfile(userId='me').execute(num_retries=self.NUM_RETRIES)
+        return resp['emailAddress']
+
+    def list_message_ids(self, query: str, page_token: str = None) -> Tuple[List[str], Optional[str]]:
+        """Pulls a single page of message ids matching the query, along with the token for the next page"""
+        self.quota.spend(self.LIST_COST)
+        resp = self.thread_service().users().messages().list(
+            userId='me', q=query, maxResults=self.PAGE_SIZE, pageToken=page_token
+        ).execute(num_retries=self.NUM_RETRIES)
+        return [x['id'] for x in resp.get('messages', [])], resp.get('nextPageToken')
+
+    def estimate_matches(self, query: str) -> int:
+        """Pulls GMail's estimate of how many messages match the query"""
+        self.quota.spend(self.LIST_COST)
+        resp = self.thread_service().users().messages().list(
+            userId='me', q=query, maxResults=1).execute(num_retries=self.NUM_RETRIES)
+        return resp.get('resultSizeEstimate', 0)
+
+    def iter_message_ids(self, query: str) -> Iterator[List[str]]:
+        """Yields pages of message ids matching the query"""
+        page_token = None
+        while True:
+            ids, page_token = self.list_message_ids(query, page_token)
+            yield ids
+            if page_token is None:
+                break
+
+
+class GMailMessageAPI(GMailMessageReader):
+    """Message methods that relabel existing mail
+
+    Docs:
+        https://developers.google.com/gmail/api/reference/rest/v1/users.messages/batchModify
+    """
+    SCOPES = [
+        'https://www.googleapis.com/auth/gmail.modify'  # Read/relabel existing messages
+    ]
+    DEFAULT_PICKLE_PATH = os.path.join('creds', 'token-modify.pickle')
+    MODIFY_COST = 50
+    # Most ids batchModify will take in a call
+    BATCH_SIZE = 1000
+
+    def batch_modify(self, message_ids: List[str], actions_dict: Dict[str, List[str]]) -> int:
+        """Applies label additions/removals to up to 1000 messages at once"""
+        body = {'ids': message_ids}
+        body.update(actions_dict)
+        self.quota.spend(self.MODIFY_COST)
+        self.thread_service().users().messages().batchModify(
+            userId='me', body=body).execute(num_retries=self.NUM_RETRIES)
+        return len(message_ids)
+
+    def _queue_backfill(self, modify_pool: ThreadPoolExecutor, in_flight: threading.BoundedSemaphore,
+                        futures: List[Future], query: str, actions_dict: Dict[str, List[str]]):
+        """Pages through the messages matching the query,
+        handing off each full batch of ids to be modified while the next page is pulled
+
+        Blocks once too many batches are waiting to be modified, so ids don't pile up in memory.
+        Batches are added to the provided futures as they're submitted, so they're still tracked
+            (along with any ids already pulled) if a later page fails
+        """
+        batch = []
+
+        def submit(ids: List[str]):
+            in_flight.acquire()
+            future = modify_pool.submit(self.batch_modify, ids, actions_dict)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+
+        try:
+            for ids in self.iter_message_ids(query):
+                batch += ids
+                while len(batch) >= self.BATCH_SIZE:
+                    submit(batch[:self.BATCH_SIZE])
+                    batch = batch[self.BATCH_SIZE:]
+        finally:
+            if len(batch) > 0:
+                submit(batch)
+
+    def backfill(self, jobs: List[Tuple[str, Dict[str, List[str]]]]) -> int:
+        """Applies the actions of each compiled query to the mail it already matches
+
+        Queries are paged through concurrently in one pool while their batchModify calls run in another,
+            so modifying starts as soon as the first batch of ids is ready.
+        Failed queries & batches are logged rather than stopping the rest.
+
+        Args:
+            jobs: list of (query, actions_dict), where actions_dict is from Action.build_actions
+        """
+        in_flight = threading.BoundedSemaphore(self.max_workers * 2)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as modify_pool, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as list_pool:
+            modifies = [[] for _ in jobs]
+            listings = [list_pool.submit(self._queue_backfill, modify_pool, in_flight, futures, query, actions)
+                        for futures, (query, actions) in zip(modifies, jobs)]
+            for (query, _), listing in zip(jobs, listings):
+                try:
+                    listing.result()
+                except Exception as e:
+                    self.log.error(f'Failed to list messages for query {query[:80]}: {e}')
+            modifies = [x for futures in modifies for x in futures]
+            wait(modifies)
+        n_modified = sum(x.result() for x in modifies if x.exception() is None)
+        for future in modifies:
+            if future.exception() is not None:
+                self.log.error(f'Failed to modify a batch of messages: {future.exception()}')
+        self.log.debug(f'Backfilled {n_modified} messages across {len(jobs)} queries.')
+        return n_modified
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from .filter_builder import GMailFilter
+from .gmail import GMailMessageReader
+from .logger import Log
+
+
+class QueryStats:
+    """Estimates how much mail each compiled query matches
+
+    Estimates are cached by a hash of the account & query, so repeat runs only
+        look up queries that changed or whose cached estimate is older than the TTL.
+    """
+    DEFAULT_CACHE_PATH = os.path.join('.cache', 'query_stats.json')
+    # Queries matching more than this many messages are flagged as risky
+    RISKY_MATCHES = 10000
+
+    def __init__(self, gmail_filter_dict: dict, cache_path: str = DEFAULT_CACHE_PATH,
+                 ttl: int = 24 * 60 * 60, message_svc: GMailMessageReader = None):
+        self.log = Log('query-stats')
+        self.gmail_filters = gmail_filter_dict
+        self.filter_tools = GMailFilter(compact=True)
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.message_svc = GMailMessageReader() if message_svc is None else message_svc
+        # Keeps estimates from one account from being reused for another sharing the cache
+        self.account = self.message_svc.get_email_address()
+        self.cache = self._load_cache()
+
+    def query_hash(self, query: str) -> str:
+        """Hashes the account & query to key the cache"""
+        return hashlib.sha1(f'{self.account}\n{query}'.encode('utf-8')).hexdigest()
+
+    def _load_cache(self) -> Dict[str, Dict[str, int]]:
+        """Loads cached estimates, dropping any that have expired"""
+        if not os.path.exists(self.cache_path):
+            return {}
+        with open(self.cache_path, 'r') as f:
+            cache = json.load(f)
+        now = time.time()
+        return {k: v for k, v in cache.items() if now - v['fetched'] < self.ttl}
+
+    def _save_cache(self):
+        """Saves the estimates to the cache file"""
+        if os.path.dirname(self.cache_path) != '':
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with open(self.cache_path, 'w') as f:
+            json.dump(self.cache, f, separators=(',', ':'))
+
+    def collect(self) -> Dict[str, List[Tuple[str, Optional[int]]]]:
+        """Compiles every label's queries and pairs each with its estimated number of matches
+
+        Failed lookups are logged and paired with None rather than stopping the rest,
+            so every estimate that was fetched still gets cached
+        """
+        label_queries = {label: self.filter_tools.query_organizer(fdict)
+                         for label, fdict in self.gmail_filters.items()}
+        to_fetch = list({self.query_hash(q): q for queries in label_queries.values() for q in queries
+                         if self.query_hash(q) not in self.cache}.items())
+        self.log.debug(f'{len(to_fetch)} queries to estimate '
+                       f'({sum(map(len, label_queries.values())) - len(to_fetch)} cached or repeated)')
+        with ThreadPoolExecutor(max_workers=self.message_svc.max_workers) as pool:
+            futures = [pool.submit(self.message_svc.estimate_matches, query) for _, query in to_fetch]
+            now = int(time.time())
+            for (qhash, query), future in zip(to_fetch, futures):
+                try:
+                    self.cache[qhash] = {'estimate': future.result(), 'fetched': now}
+                except Exception as e:
+                    self.log.error(f'Failed to estimate matches for query {query[:80]}: {e}')
+        self._save_cache()
+
+        return {label: [(q, self.cache.get(self.query_hash(q), {}).get('estimate')) for q in queries]
+                for label, queries in label_queries.items()}
+
+    def log_report(self):
+        """Logs the estimated matches for each label, flagging queries that match nothing or a lot"""
+        for label, stats in self.collect().items():
+            self.log.info(f'{label}: ~{sum(x[1] for x in stats if x[1] is not None)} messages '
+                          f'across {len(stats)} filters')
+            for i, (query, estimate) in enumerate(stats):
+                if estimate is None:
+                    self.log.warning(f'{label} filter {i + 1} could not be estimated: {query[:80]}')
+                elif estimate == 0:
+                    self.log.warning(f'{label} filter {i + 1} matches nothing: {query[:80]}')
+                elif estimate > self.RISKY_MATCHES:
+                    self.log.warning(f'{label} filter {i + 1} matches ~{estimate} messages: {query[:80]}')
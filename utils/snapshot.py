@@ -0,0 +1,155 @@
+import os
+import gzip
+import json
+import time
+from typing import Dict, List
+from .gmail import BatchError, GMailLabelAPI, GMailFilterAPI
+from .logger import Log
+
+
+class FilterSnapshot:
+    """Saves the live filter set to a file and restores it
+
+    Snapshots are gzipped JSON holding the filters as returned by the API
+        and a map of the user label ids they reference to the label names,
+        so filters can be pointed at the right labels even if those were recreated with new ids.
+    """
+    VERSION = 1
+    DEFAULT_DIR = 'snapshots'
+    # Most filters GMail allows on an account
+    FILTER_LIMIT = 1000
+
+    def __init__(self, label_svc: GMailLabelAPI = None, filter_svc: GMailFilterAPI = None):
+        self.log = Log('filter-snapshot')
+        self.label_svc = GMailLabelAPI() if label_svc is None else label_svc
+        self.filter_svc = GMailFilterAPI() if filter_svc is None else filter_svc
+
+    def default_path(self) -> str:
+        """Builds a timestamped path for a new snapshot"""
+        return os.path.join(self.DEFAULT_DIR, f'filters-{time.strftime("%Y%m%d-%H%M%S")}.json.gz')
+
+    def save(self, path: str = None) -> str:
+        """Saves the live filters & user labels"""
+        path = self.default_path() if path is None else path
+        labels = {x['id']: x['name'] for x in self.label_svc.get_all_labels(label_type='user')}
+        filters = [{'criteria': x.get('criteria', {}), 'action': x.get('action', {})}
+                   for x in self.filter_svc.list_filters()]
+        snapshot = {
+            'version': self.VERSION,
+            'created': int(time.time()),
+            'labels': labels,
+            'filters': filters
+        }
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        self.log.debug(f'Saved {len(filters)} filters and {len(labels)} labels to {path}')
+        return path
+
+    def load(self, path: str) -> dict:
+        """Reads in a snapshot, checking that its version can be restored"""
+        if not os.path.isfile(path):
+            raise ValueError(f'File does not exist: {path}')
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        if snapshot.get('version') != self.VERSION:
+            raise ValueError(f'Unsupported snapshot version: {snapshot.get("version")}')
+        return snapshot
+
+    def _map_label_ids(self, snapshot: dict) -> Dict[str, str]:
+        """Maps the label ids in the snapshot to the live label ids, creating any labels that are missing"""
+        live_labels = {x['name']: x['id'] for x in self.label_svc.get_all_labels(label_type='user')}
+        used_ids = {label_id for filt in snapshot['filters']
+                    for ids in filt['action'].values() if isinstance(ids, list)
+                    for label_id in ids if label_id in snapshot['labels']}
+        missing = sorted({snapshot['labels'][x] for x in used_ids} - set(live_labels.keys()))
+        if len(missing) > 0:
+            self.log.debug(f'Creating {len(missing)} missing labels...')
+            try:
+                created = self.label_svc.create_labels(missing)
+            except BatchError as e:
+                # Stop before touching any filters
+                self._log_failed('create label', missing, e)
+                raise
+            for label in created:
+                live_labels[label['name']] = label['id']
+        return {x: live_labels[snapshot['labels'][x]] for x in used_ids}
+
+    @staticmethod
+    def _remap_filter(filt: dict, id_map: Dict[str, str]) -> dict:
+        """Points a filter's actions at the live label ids. System labels (e.g., INBOX) are left as they are"""
+        action = {k: [id_map.get(x, x) for x in v] if isinstance(v, list) else v
+                  for k, v in filt['action'].items()}
+        return {'criteria': filt['criteria'], 'action': action}
+
+    @staticmethod
+    def _filter_key(filt: dict) -> str:
+        """Builds a key for comparing filters by their criteria & actions"""
+        return json.dumps({'criteria': filt.get('criteria', {}), 'action': filt.get('action', {})}, sort_keys=True)
+
+    def _log_failed(self, verb: str, items: List[str], err: BatchError):
+        """Logs each request in a batched call that failed"""
+        for i, e in sorted(err.errors.items()):
+            self.log.error(f'Failed to {verb} {items[i]}: {e}')
+
+    def _create_filters(self, filters: List[dict]):
+        """Creates the filters, logging each that failed along with the ids of those that were created"""
+        try:
+            created = self.filter_svc.create_filters(filters)
+        except BatchError as e:
+            self._log_failed('create filter', [json.dumps(x['criteria']) for x in filters], e)
+            created_ids = [x['id'] for x in e.responses if x is not None]
+            self.log.error(f'Created {len(created_ids)} of {len(filters)} filters.')
+            if len(created_ids) > 0:
+                self.log.error(f'Created filter ids: {", ".join(created_ids)}')
+            raise
+        self.log.debug(f'Created {len(created)} filters.')
+
+    def _delete_filters(self, filter_ids: List[str]):
+        """Removes the filters, logging each that failed"""
+        try:
+            self.filter_svc.delete_filters(filter_ids)
+        except BatchError as e:
+            self._log_failed('remove filter', filter_ids, e)
+            raise
+        self.log.debug(f'Removed {len(filter_ids)} old live filters.')
+
+    def restore(self, path: str):
+        """Replaces the live filters with those in the snapshot
+
+        The snapshot's filters are created first; live filters are only removed once that succeeds,
+            so a failed restore leaves the account with its current filters plus whichever were created.
+        If both sets together wouldn't fit under GMail's filter limit, the live filters are saved to a new snapshot
+            and removed first instead.
+        Live filters already matching one in the snapshot are kept as they are.
+        """
+        snapshot = self.load(path)
+        id_map = self._map_label_ids(snapshot)
+        filters = [self._remap_filter(x, id_map) for x in snapshot['filters']]
+
+        live_ids = {self._filter_key(x): x['id'] for x in self.filter_svc.list_filters()}
+        # GMail rejects duplicate filters, so only create those not already live
+        to_create = list({self._filter_key(x): x for x in filters if self._filter_key(x) not in live_ids}.values())
+        keep_ids = {live_ids[self._filter_key(x)] for x in filters if self._filter_key(x) in live_ids}
+        to_delete = [x for x in live_ids.values() if x not in keep_ids]
+        if len(to_create) + len(keep_ids) > self.FILTER_LIMIT:
+            raise ValueError(f'The snapshot holds {len(to_create) + len(keep_ids)} filters, '
+                             f'over GMail\'s limit of {self.FILTER_LIMIT}')
+
+        self.log.debug(f'Restoring {len(to_create)} filters ({len(keep_ids)} already live)...')
+        if len(to_create) + len(live_ids) <= self.FILTER_LIMIT:
+            try:
+                self._create_filters(to_create)
+            except BatchError:
+                self.log.error(f'Left the {len(to_delete)} old live filters in place.')
+                raise
+            self._delete_filters(to_delete)
+        else:
+            backup_path = self.save()
+            self.log.warning(f'Restoring alongside the {len(live_ids)} live filters would exceed GMail\'s limit '
+                             f'of {self.FILTER_LIMIT}. Removing {len(to_delete)} old live filters first '
+                             f'(saved to {backup_path}).')
+            self._delete_filters(to_delete)
+            self._create_filters(to_create)
+        self.log.debug('Restore complete.')
@@ -0,0 +1,30 @@
+from .filter_analyzer import FilterAnalyzer
+
+
+def test_and_qualified_criteria_are_not_overlaps():
+    analyzer = FilterAnalyzer({
+        'German': {'data': [{'or-from': ['*feedblitz*']}, {'join': 'and'}, {'or-text': ['German']}]},
+        'Polish': {'data': [{'or-from': ['*feedblitz*']}, {'join': 'and'}, {'or-text': ['Polish']}]},
+    })
+    assert analyzer.find_overlaps() == []
+
+
+def test_or_criteria_overlap_with_conflicts():
+    analyzer = FilterAnalyzer({
+        'Trash': {'data': [{'or-from': ['a@site.com', 'b@site.com']}], 'actions': ['delete-email']},
+        'Keep': {'data': [{'or-text': ['x']}, {'join': 'or'}, {'or-from': ['A@site.com']}],
+                 'actions': ['always-important']},
+    })
+    overlaps = analyzer.find_overlaps()
+    assert [(x['entry'], x['labels']) for x in overlaps] == [('a@site.com', ['Keep', 'Trash'])]
+    assert overlaps[0]['conflicts'] == ['deleted while marked important']
+
+
+def test_and_joined_values_and_sections():
+    analyzer = FilterAnalyzer({
+        'A': {'data': [{'and-text': ['x', 'y']}, {'join': 'or'}, {'section': [{'or-from': ['*@site.com']}]}]},
+        'B': {'data': [{'or-section': [{'or-from': ['c@mail.site.com']}, {'join': 'and'}, {'or-text': ['z']}]},
+                       {'join': 'or'}, {'or-from': ['d@mail.site.com']}]},
+    })
+    assert set(analyzer.term_index.keys()) == set()
+    assert [x['entry'] for x in analyzer.find_shadowed()] == ['d@mail.site.com']
@@ -0,0 +1,80 @@
+from .filter_builder import GMailFilter, QueryParser
+
+
+def test_parser_or_binds_tighter_than_and():
+    assert QueryParser('a b|c').parse() == QueryParser('a (b|c)').parse()
+    assert QueryParser('a b|c').parse() != QueryParser('(a b)|c').parse()
+
+
+def test_parser_applies_key_to_group():
+    assert QueryParser('from:(a|b)').parse() == QueryParser('{from:a from:b}').parse()
+    assert QueryParser('from:(a|b)').parse() != QueryParser('(a|b)').parse()
+
+
+def test_parser_reads_xml_quotes():
+    assert QueryParser('(&quot;big world&quot;|&quot;x&quot;)').parse() == QueryParser('("big world"|x)').parse()
+
+
+def test_is_equivalent():
+    assert GMailFilter.is_equivalent('from:(a) AND ("b")', 'from:a b')
+    assert GMailFilter.is_equivalent('-("spam"|"junk")', '-(junk|spam)')
+    assert not GMailFilter.is_equivalent('from:(a) AND ("b")', 'from:a|b')
+    assert not GMailFilter.is_equivalent('subject:(hello world)', 'subject:hello world')
+
+
+def test_is_equivalent_malformed_query():
+    assert not GMailFilter.is_equivalent('(a', 'a')
+    assert not GMailFilter.is_equivalent('"a', 'a')
+
+
+def test_merge_same_keys():
+    data = [{'or-from': ['a', 'b']}, {'join': 'or'}, {'or-from': ['b', 'c']}]
+    assert GMailFilter(compact=True)._merge_same_keys(data) == [{'or-from': ['a', 'b', 'c']}]
+
+
+def test_merge_same_keys_skips_and_negated_and_different_keys():
+    data = [
+        {'or-from': ['a']}, {'join': 'and'}, {'or-from': ['b']},
+        {'join': 'or'}, {'or-from-not': ['c']}, {'join': 'or'}, {'or-from-not': ['d']},
+        {'join': 'or'}, {'or-to': ['e']},
+    ]
+    assert GMailFilter(compact=True)._merge_same_keys(data) == data
+
+
+def test_merge_same_keys_skips_values_needing_quotes():
+    data = [{'or-subject': ['hello world']}, {'join': 'or'}, {'or-subject': ['foo']}]
+    compact = GMailFilter(compact=True)
+    assert compact._merge_same_keys(data) == data
+    query = compact.query_organizer({'data': data})
+    assert query == ['subject:(hello world)|subject:foo']
+    assert GMailFilter.is_equivalent(query[0], GMailFilter().query_organizer({'data': data})[0])
+
+
+def test_merge_same_keys_in_sections():
+    data = [{'or-section': [{'or-text': ['a']}, {'join': 'or'}, {'or-text': 'b'}]}]
+    assert GMailFilter(compact=True)._merge_same_keys(data) == [{'or-section': [{'or-text': ['a', 'b']}]}]
+
+
+def test_compact_falls_back_to_verbose_when_not_equivalent(monkeypatch):
+    data = [{'or-subject': ['hello world']}, {'join': 'or'}, {'or-subject': ['foo']}]
+    compact = GMailFilter(compact=True)
+    # Force the unsafe merge to produce subject:(hello world|foo)
+    monkeypatch.setattr(compact, '_merge_same_keys', lambda _: [{'or-subject': ['hello world', 'foo']}])
+    assert compact.query_organizer({'data': data}) == GMailFilter().query_organizer({'data': data})
+
+
+def test_compact_keeps_brackets_on_multi_word_keyed_term():
+    fdict = {'data': [{'or-subject': ['hello world']}, {'join': 'or'}, {'or-from': ['a@b.com']}]}
+    assert GMailFilter(compact=True).query_organizer(fdict) == ['subject:(hello world)|from:a@b.com']
+
+
+def test_compact_matches_verbose():
+    fdict = {'data': [
+        {'or-from': ['a@b.com', 'c@d.com']}, {'join': 'or'}, {'or-from': ['e@f.com']},
+        {'join': 'and'}, {'or-text': ['hello', 'big world', 'OR', 'a:b']},
+        {'or-section': [{'or-subject': ['x']}, {'join': 'and'}, {'or-text-not': ['spam', 'junk']}]},
+    ]}
+    compact = GMailFilter(compact=True).query_organizer(fdict)
+    verbose = GMailFilter().query_organizer(fdict)
+    assert compact == ['from:(a@b.com|c@d.com|e@f.com) (hello|"big world"|"OR"|"a:b")|(subject:x -(spam|junk))']
+    assert GMailFilter.is_equivalent(compact[0], verbose[0])
@@ -0,0 +1,89 @@
+import gzip
+import json
+import pytest
+pytest.importorskip('googleapiclient')
+from .gmail import BatchError
+from .snapshot import FilterSnapshot
+
+
+class FakeLabels:
+    def __init__(self, labels):
+        self.labels = labels
+        self.created = []
+
+    def get_all_labels(self, label_type='user'):
+        return list(self.labels)
+
+    def create_labels(self, names):
+        new = [{'id': f'New{name}', 'name': name} for name in names]
+        self.created += names
+        self.labels += new
+        return new
+
+
+class FakeFilters:
+    def __init__(self, live, fail_queries=()):
+        self.live = live
+        self.fail_queries = fail_queries
+
+    def list_filters(self):
+        return list(self.live)
+
+    def create_filters(self, bodies):
+        responses = [None if x['criteria'].get('query') in self.fail_queries else dict(x, id=f'f{i}')
+                     for i, x in enumerate(bodies)]
+        self.live += [x for x in responses if x is not None]
+        errors = {i: ValueError('rejected') for i, x in enumerate(responses) if x is None}
+        if len(errors) > 0:
+            raise BatchError(responses, errors)
+        return responses
+
+    def delete_filters(self, ids):
+        self.live = [x for x in self.live if x['id'] not in ids]
+        return ids
+
+
+def write_snapshot(path, filters, labels):
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        json.dump({'version': FilterSnapshot.VERSION, 'created': 0, 'labels': labels, 'filters': filters}, f)
+    return str(path)
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    return write_snapshot(tmp_path / 'snap.json.gz', [
+        {'criteria': {'query': 'a'}, 'action': {'addLabelIds': ['OldKept']}},
+        {'criteria': {'query': 'b'}, 'action': {'addLabelIds': ['OldGone', 'INBOX']}},
+    ], {'OldKept': 'Kept', 'OldGone': 'Gone'})
+
+
+def live_filters():
+    return [
+        {'id': 'keep', 'criteria': {'query': 'a'}, 'action': {'addLabelIds': ['Kept1']}},
+        {'id': 'stale', 'criteria': {'query': 'z'}, 'action': {}},
+    ]
+
+
+def test_restore_remaps_labels_and_keeps_live_matches(snapshot_path):
+    labels = FakeLabels([{'id': 'Kept1', 'name': 'Kept'}])
+    filters = FakeFilters(live_filters())
+    FilterSnapshot(labels, filters).restore(snapshot_path)
+    assert labels.created == ['Gone']
+    assert sorted((x['id'], x['criteria']['query'], x['action']['addLabelIds'][0]) for x in filters.live) == [
+        ('f0', 'b', 'NewGone'), ('keep', 'a', 'Kept1')]
+
+
+def test_failed_restore_leaves_live_filters(snapshot_path):
+    filters = FakeFilters(live_filters(), fail_queries=('b',))
+    with pytest.raises(BatchError):
+        FilterSnapshot(FakeLabels([{'id': 'Kept1', 'name': 'Kept'}]), filters).restore(snapshot_path)
+    assert [x['id'] for x in filters.live] == ['keep', 'stale']
+
+
+def test_restore_over_filter_limit_removes_live_first(snapshot_path, monkeypatch, tmp_path):
+    monkeypatch.setattr(FilterSnapshot, 'FILTER_LIMIT', 2)
+    monkeypatch.setattr(FilterSnapshot, 'DEFAULT_DIR', str(tmp_path / 'backups'))
+    filters = FakeFilters(live_filters())
+    FilterSnapshot(FakeLabels([{'id': 'Kept1', 'name': 'Kept'}]), filters).restore(snapshot_path)
+    assert sorted(x['id'] for x in filters.live) == ['f0', 'keep']
+    assert len(list((tmp_path / 'backups').iterdir())) == 1
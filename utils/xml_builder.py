@@ -28,10 +28,10 @@ class XMLBuilder:
         <apps:property name='sizeUnit' value='s_smb'/>
     </entry>"""
 
-    def __init__(self, gmail_filter_dict: dict, output_path: str = None):
+    def __init__(self, gmail_filter_dict: dict, output_path: str = None, compact: bool = False):
         self.log = Log('xml-builder')
         self.gmail_filters = gmail_filter_dict
-        self.filter_tools = GMailFilter(as_xml=True)
+        self.filter_tools = GMailFilter(as_xml=True, compact=compact)
         if output_path is not None:
             self.output_path = output_path
         else:
@@ -40,7 +40,7 @@ class XMLBuilder:
 
     def entry_builder(self) -> Tuple[List[int], str]:
         """Builds the actual entry for the filter"""
-        xml_str = ''
+        entries = []
         fids = []
         for filter_name, fdict in self.gmail_filters.items():
             self.log.debug(f'Building entries for {filter_name}')
@@ -63,9 +63,9 @@ class XMLBuilder:
                 fids.append(int(time.time() * 10000000))
                 fdict['built_filter'] = '({})'.format(query.replace("'", "&apos;"))
                 # Build the XML for the entry
-                xml_str += '{}'.format(self.ENTRY_BASE.format(**fdict))
+                entries.append(self.ENTRY_BASE.format(**fdict))
 
-        return fids, xml_str
+        return fids, ''.join(entries)
 
     @staticmethod
     def _time_xml() -> str:
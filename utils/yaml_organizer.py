@@ -7,7 +7,11 @@ Sorts emails in to/from/cc/bcc sections by domain (if applicable)
 import os
 import re
 import sys
+import json
 import yaml
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, Tuple
 from .logger import Log
 
 
@@ -35,21 +39,68 @@ class YamlPath:
 
 class YamlWrapper:
     """Wrapper class to clean YAML files"""
-    def __init__(self, debug: bool = False):
+    EMAIL_KEYS = ('from', 'to', 'bcc', 'cc')
+    # Strips everything but word characters, dots and @ from an email
+    CLEANER = re.compile(r'[^\w.@]', re.I)
+    WORDS = re.compile(r'[\w]+')
+    # Hashes of each label's content after it was last cleaned
+    DEFAULT_HASH_PATH = os.path.join('.cache', 'clean_hashes.json')
+    # Use the faster libyaml-backed loader/dumper when PyYAML was built with it
+    LOADER = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+    DUMPER = getattr(yaml, 'CDumper', yaml.Dumper)
+
+    def __init__(self, debug: bool = False, hash_path: str = DEFAULT_HASH_PATH):
         self.log = Log('yaml-handler')
         self.yaml_obj = YamlPath(debug)
         self.new_yaml_path = os.path.join(self.yaml_obj.yaml_dir, 'cleaned_filters.yaml')
+        self.hash_path = hash_path
         self.gmail_filters = self._load_yaml()
 
     def _load_yaml(self) -> dict:
         """Loads a yaml file"""
         with open(self.yaml_obj.yaml_path, 'r') as f:
-            return yaml.load(f, Loader=yaml.FullLoader)
+            return yaml.load(f, Loader=self.LOADER)
 
     def _save_yaml(self):
+        """Writes the filters to the new file one label at a time"""
         self.log.debug(f'Saving cleaned YAML to {self.new_yaml_path}.')
         with open(self.new_yaml_path, 'w') as f:
-            f.write(yaml.dump(self.gmail_filters, allow_unicode=True, indent=4, default_flow_style=False))
+            # Labels are written in the same (sorted) order as dumping the whole document at once
+            for filter_name in sorted(self.gmail_filters.keys()):
+                yaml.dump({filter_name: self.gmail_filters[filter_name]}, f, Dumper=self.DUMPER,
+                          allow_unicode=True, indent=4, default_flow_style=False)
+
+    def _load_hashes(self) -> Dict[str, str]:
+        """Loads the hashes of the labels as they were last cleaned"""
+        if not os.path.exists(self.hash_path):
+            return {}
+        with open(self.hash_path, 'r') as f:
+            return json.load(f)
+
+    def _save_hashes(self):
+        """Saves the hashes of the cleaned labels"""
+        if os.path.dirname(self.hash_path) != '':
+            os.makedirs(os.path.dirname(self.hash_path), exist_ok=True)
+        hashes = {k: self.label_hash(k, v) for k, v in self.gmail_filters.items()}
+        with open(self.hash_path, 'w') as f:
+            json.dump(hashes, f, separators=(',', ':'))
+
+    @staticmethod
+    def label_hash(filter_name: str, fdict: dict) -> str:
+        """Hashes a label's name & content"""
+        content = json.dumps([filter_name, fdict], sort_keys=True, default=str)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def domain_sort_key(email: str) -> Tuple[str, str]:
+        """Builds the key to sort an email on: its domain or, when lacking one, its first word.
+        Ties are broken by the email itself. Cached, as the same emails tend to show up across labels
+        """
+        cleaned = YamlWrapper.WORDS.findall(YamlWrapper.CLEANER.sub('', email))
+        if len(cleaned) == 0:
+            return '', email
+        return cleaned[-2] if len(cleaned) > 1 else cleaned[0], email
 
     def data_sorter(self, data: dict) -> dict:
         """Sort the actual list of emails, terms, etc."""
@@ -57,30 +108,45 @@ class YamlWrapper:
         if k == 'section':
             # Build a list of the different make ups of the section
             return {k: [self.data_sorter(vv) for vv in v]}
-        elif any([x in k for x in ['from', 'to', 'bcc', 'cc']]):
+        elif any([x in k for x in self.EMAIL_KEYS]):
             # Working with emails. let's sort them as best we can by domain
-            #   we'll make a 'cleaned' list of just domains or fragments and sort on that
-            cleaner = re.compile(r'[^\w.@]', re.I)
-            cleaned = [re.findall(r'[\w]+', cleaner.sub('', x)) for x in v]
-            sortable = [x[-2] if len(x) > 1 else x[0] for x in cleaned]
-            # We'll then bind the two lists together and sort by the cleaned items
-            return {k: [x for _, x in sorted(zip(sortable, v))]}
+            return {k: sorted(v, key=self.domain_sort_key)}
         else:
             return {k: v}
 
-    def sort_and_save(self):
+    def label_sorter(self, fdict: dict) -> dict:
+        """Sorts the 'data' section of a label, or its actions when it has no data"""
+        fdict = dict(fdict)
+        if 'data' in fdict.keys():
+            fdict['data'] = [self.data_sorter(section) for section in fdict['data']]
+        elif 'actions' in fdict.keys():
+            # Sort actions
+            fdict['actions'] = sorted(fdict['actions'])
+        return fdict
+
+    def _changed_labels(self, incremental: bool) -> List[str]:
+        """Lists the labels to sort. When incremental, skips labels unchanged since they were last cleaned"""
+        if not incremental:
+            return list(self.gmail_filters.keys())
+        hashes = self._load_hashes()
+        return [k for k, v in self.gmail_filters.items() if hashes.get(k) != self.label_hash(k, v)]
+
+    def check_sorted(self, incremental: bool = False) -> List[str]:
+        """Lists the labels that aren't sorted, without changing anything"""
+        return [x for x in self._changed_labels(incremental)
+                if self.label_sorter(self.gmail_filters[x]) != self.gmail_filters[x]]
+
+    def sort_and_save(self, incremental: bool = False):
         """Sorts emails listed by domain or, when lacking an obvious domain,
-        the first word in the string. Saves to the new file when complete."""
+        the first word in the string. Saves to the new file when complete.
 
-        for filter_name, fdict in self.gmail_filters.items():
+        Args:
+            incremental: when True, only sorts labels that changed since they were last cleaned
+        """
+        changed = self._changed_labels(incremental)
+        self.log.debug(f'Sorting data from {len(changed)} of {len(self.gmail_filters)} labels...')
+        for filter_name in changed:
             # Sort the 'data' section, leave everything else alone
-            self.log.debug(f'Sorting data from {filter_name}...')
-            if 'data' in fdict.keys():
-                for i, section in enumerate(fdict['data']):
-                    fdict['data'][i] = self.data_sorter(section)
-            elif 'actions' in fdict.keys():
-                # Sort actions
-                fdict['actions'] = sorted(fdict['actions'])
-            # Write back to our filters
-            self.gmail_filters[filter_name] = fdict
+            self.gmail_filters[filter_name] = self.label_sorter(self.gmail_filters[filter_name])
         self._save_yaml()
+        self._save_hashes()